@@ -0,0 +1,81 @@
+"""Benchmark kecil untuk main.py (tidak ikut ke image Docker).
+
+    python bench.py sheets   # butuh GOOGLE_CREDENTIALS & SPREADSHEET_ID
+    python bench.py layar    # biaya render layar statis & paging FAQ
+"""
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("ADMIN_GROUP_ID", "0")
+
+import gspread
+
+import main
+
+
+def ukur(nama, fn, n, satuan="ms"):
+    skala = {"ms": 1e3, "µs": 1e6}[satuan]
+    hasil = []
+    for _ in range(n):
+        mulai = time.perf_counter()
+        fn()
+        hasil.append((time.perf_counter() - mulai) * skala)
+    hasil.sort()
+    p95 = hasil[min(len(hasil) - 1, int(len(hasil) * 0.95))]
+    print(f"{nama:<40} median {statistics.median(hasil):8.2f} {satuan}   p95 {p95:8.2f} {satuan}   (n={n})")
+
+
+def bench_sheets(n=20):
+    if not main.client:
+        sys.exit("Gagal: GOOGLE_CREDENTIALS / SPREADSHEET_ID belum diset, tidak ada angka sheets.")
+
+    # Baseline: client gspread dengan sesi bawaannya sendiri + open_by_key tiap
+    # panggilan, seperti alur lama. Jalur oauth2client + file sementara tidak
+    # bisa diulang karena dependensinya sudah dibuang; biaya itu hanya sekali
+    # saat startup, bukan per panggilan.
+    client_lama = gspread.Client(auth=main.creds)
+    baseline = lambda: client_lama.open_by_key(main.SPREADSHEET_ID).worksheet("FAQ").get_all_values()
+    # Hanya beda registry worksheet: sama-sama lewat sesi bersama main.client
+    tanpa_registry = lambda: main.client.open_by_key(main.SPREADSHEET_ID).worksheet("FAQ").get_all_values()
+    registry = lambda: main.get_worksheet("FAQ").get_all_values()
+
+    # Pemanasan: handshake TLS pertama jangan ikut dihitung di sisi mana pun
+    baseline()
+    tanpa_registry()
+    registry()
+
+    ukur("baseline (sesi gspread, open_by_key)", baseline, n)
+    ukur("sesi bersama, open_by_key", tanpa_registry, n)
+    ukur("sesi bersama, registry worksheet", registry, n)
+
+
+def bench_layar(n=10000):
+    teks = main.TEKS_LAYAR[main.BAHASA_DEFAULT]
+    ukur("bangun semua layar (startup)", lambda: main.bangun_layar(teks), n // 10, "µs")
+
+    for nama in main.LAYAR[main.BAHASA_DEFAULT]:
+        ukur(f"layar {nama}", lambda: main.layar(nama), n, "µs")
+
+    records = [(f"Pertanyaan {i}", "Jawaban panjang " * 20) for i in range(100)]
+
+    def paging_faq():
+        blok = ["📑 *Tatakunan Umum (FAQ)*"]
+        for pertanyaan, jawaban in records:
+            blok += main.blok_faq(pertanyaan, jawaban)
+        return main.bagi_halaman(blok)
+
+    halaman = paging_faq()
+    ukur(f"paging FAQ ({len(halaman)} halaman)", paging_faq, n // 100, "µs")
+    ukur("layar halaman FAQ", lambda: main.layar_halaman(halaman, 1, "faq"), n, "µs")
+
+
+BENCHMARKS = {
+    "sheets": bench_sheets,
+    "layar": bench_layar,
+}
+
+if __name__ == "__main__":
+    for nama in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[nama]()
@@ -1,11 +1,20 @@
 import logging
 import os
 import json
-import tempfile
 import asyncio
+import hashlib
+import heapq
+import atexit
+import contextvars
+import functools
+import queue
+import random
+import time
+import traceback
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime, timedelta, timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.constants import ParseMode
+from telegram.constants import MessageLimit, ParseMode
 from telegram.ext import (
     ApplicationBuilder,
     ContextTypes,
@@ -15,20 +24,130 @@ from telegram.ext import (
     filters,
 )
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
 
 # =========================
 # LOGGING
 # =========================
-logging.basicConfig(level=logging.INFO)
+# JSON per baris, ditulis oleh thread QueueListener supaya I/O log tidak
+# menahan event loop. Isi pesan klien tidak boleh ikut tercatat.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", 0.1))
+LOG_HANDLER_LAMBAT_MS = int(os.getenv("LOG_HANDLER_LAMBAT_MS", 1000))
+
+FIELD_RAHASIA = {"text", "alias", "usia", "alamat", "pertanyaan", "balasan", "isi"}
+ATTR_STANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "taskName"}
+
+log_update_id = contextvars.ContextVar("log_update_id", default=None)
+log_handler = contextvars.ContextVar("log_handler", default=None)
+log_kode = contextvars.ContextVar("log_kode", default=None)
+
+class KonteksLogFilter(logging.Filter):
+    """Jalan di thread pemanggil: sampling debug, sensor, tempel konteks update."""
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG:
+            if random.random() >= LOG_DEBUG_SAMPLE:
+                return False
+            record.sample_rate = LOG_DEBUG_SAMPLE
+
+        # Argumen log library (mis. parameter sendMessage dari PTB) bisa memuat
+        # teks dan alias klien; yang dicatat cukup template pesannya.
+        if record.name != __name__ and record.args:
+            record.args = None
+            record.args_redacted = True
+
+        record.update_id = getattr(record, "update_id", None) or log_update_id.get()
+        record.handler = getattr(record, "handler", None) or log_handler.get()
+        record.kode = getattr(record, "kode", None) or log_kode.get()
+
+        if record.exc_info:
+            record.exc = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return True
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key in ATTR_STANDAR or value is None:
+                continue
+            data[key] = "[redacted]" if key in FIELD_RAHASIA else value
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+log_queue = queue.SimpleQueue()
+log_queue_handler = QueueHandler(log_queue)
+log_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+log_queue_handler.addFilter(KonteksLogFilter())
+
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(JsonFormatter())
+
+log_listener = QueueListener(log_queue, log_stream_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logging.basicConfig(level=LOG_LEVEL, handlers=[log_queue_handler])
+logging.getLogger("httpx").setLevel(logging.WARNING)  # satu baris per getUpdates
+logging.getLogger("telegram").setLevel(logging.INFO)  # debug PTB memuat isi pesan
 logger = logging.getLogger(__name__)
 
+def dicatat(handler):
+    """Bungkus handler: set konteks log per update dan catat durasinya."""
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        token_update = log_update_id.set(getattr(update, "update_id", None))
+        token_handler = log_handler.set(handler.__name__)
+        token_kode = log_kode.set(None)
+        mulai = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception as e:
+            logger.exception("Handler gagal")
+            e.sudah_dicatat = True
+            raise
+        finally:
+            durasi_ms = round((time.perf_counter() - mulai) * 1000, 1)
+            if durasi_ms >= LOG_HANDLER_LAMBAT_MS:
+                logger.warning("Handler lambat", extra={"durasi_ms": durasi_ms})
+            else:
+                logger.debug("Handler selesai", extra={"durasi_ms": durasi_ms})
+            log_kode.reset(token_kode)
+            log_handler.reset(token_handler)
+            log_update_id.reset(token_update)
+
+    return wrapper
+
+async def catat_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Error handler PTB; error dari handler yang dibungkus dicatat() sudah tercatat."""
+    if getattr(context.error, "sudah_dicatat", False):
+        return
+    logger.error(
+        "Error tidak tertangani",
+        exc_info=context.error,
+        extra={"update_id": getattr(update, "update_id", None)}
+    )
+
 # =========================
 # ENV
 # =========================
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_GROUP_ID = int(os.getenv("ADMIN_GROUP_ID"))
 SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
+MAX_TIKET_ADMIN = int(os.getenv("MAX_TIKET_ADMIN", 3))
+MAX_LAMPIRAN_MB = int(os.getenv("MAX_LAMPIRAN_MB", 10))
+
+AMBANG_RISIKO_TINGGI = 3
 
 def is_admin_group(update: Update):
     return update.effective_chat and update.effective_chat.id == ADMIN_GROUP_ID
@@ -36,67 +155,285 @@ def is_admin_group(update: Update):
 # =========================
 # GOOGLE SHEETS
 # =========================
+# Satu sesi keep-alive untuk semua panggilan Sheets, kredensial langsung
+# dari env (tanpa file sementara), token diperbarui sebelum kedaluwarsa.
+# Semua panggilan gspread jalan berurutan di thread event loop, jadi pool
+# bawaan requests sudah cukup; ukuran pool sengaja tidak disetel.
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", 15))
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+TOKEN_CEK_INTERVAL = 60  # detik
+
 client = None
+creds = None
+token_request = None
+spreadsheet = None
+worksheets = {}
 sheet_main = None
 
+def get_worksheet(nama):
+    """Handle worksheet disimpan sekali; open_by_key() tiap panggilan = request metadata ekstra."""
+    ws = worksheets.get(nama)
+    if ws is None:
+        ws = spreadsheet.worksheet(nama)
+        worksheets[nama] = ws
+    return ws
+
+def refresh_token_jika_perlu():
+    if not creds:
+        return
+    now_utc = datetime.now(timezone.utc).replace(tzinfo=None)  # expiry google-auth naive UTC
+    if not creds.valid or not creds.expiry or creds.expiry - now_utc < TOKEN_REFRESH_MARGIN:
+        creds.refresh(token_request)
+
+async def jaga_token_google():
+    # AuthorizedSession memang refresh sendiri, tapi baru saat ada request dan
+    # di thread event loop: handler yang kebetulan kena token kedaluwarsa ikut
+    # menunggu round-trip ke endpoint token. Loop ini refresh lebih dulu di
+    # worker thread, jadi panggilan Sheets dari handler selalu pakai token valid.
+    while True:
+        try:
+            await asyncio.to_thread(refresh_token_jika_perlu)
+        except Exception as e:
+            logger.error("Gagal refresh token Google", extra={"error": str(e)})
+        await asyncio.sleep(TOKEN_CEK_INTERVAL)
+
 try:
     scope = [
-        "https://spreadsheets.google.com/feeds",
+        "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive",
     ]
     google_creds_env = os.getenv("GOOGLE_CREDENTIALS")
 
     if google_creds_env:
-        creds_dict = json.loads(google_creds_env)
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False) as temp_file:
-            json.dump(creds_dict, temp_file)
-            temp_creds_path = temp_file.name
+        creds = Credentials.from_service_account_info(json.loads(google_creds_env), scopes=scope)
+        token_request = Request(requests.Session())
 
-        creds = ServiceAccountCredentials.from_json_keyfile_name(temp_creds_path, scope)
-        os.unlink(temp_creds_path)
+        session = AuthorizedSession(creds, auth_request=token_request)
+        # Retry koneksi: Google bisa menutup koneksi keep-alive yang lama menganggur
+        session.mount("https://", HTTPAdapter(max_retries=2))
 
-        client = gspread.authorize(creds)
-        ss = client.open_by_key(SPREADSHEET_ID)
-        sheet_main = ss.worksheet("Konsultasi")
+        refresh_token_jika_perlu()
+
+        client = gspread.Client(auth=creds, session=session)
+        client.set_timeout(SHEETS_TIMEOUT)
+        spreadsheet = client.open_by_key(SPREADSHEET_ID)
+        sheet_main = get_worksheet("Konsultasi")
 
         logger.info("✅ Connected to Google Sheets")
 
 except Exception as e:
-    logger.error(f"❌ Sheets Error: {e}")
+    logger.error("❌ Sheets Error", extra={"error": str(e)})
 
 # =========================
-# MENU
+# LAYAR (TEKS & KEYBOARD STATIS)
 # =========================
-def menu_utama_keyboard():
-    keyboard = [
-        [InlineKeyboardButton("ℹ️ Panduan Layanan", callback_data="panduan")],
-        [InlineKeyboardButton("📋 Tatakunan Umum", callback_data="tatakunan_umum")],
-        [InlineKeyboardButton("📋 Cek Risiko HIV", callback_data="cek_risiko")],
-        [InlineKeyboardButton("📨 Kirim Tatakunan", callback_data="kirim_tatakunan")],
-        [InlineKeyboardButton("💬 Chat dengan Admin", callback_data="chat_admin_info")],
-        [InlineKeyboardButton("📚 Media Edukasi", callback_data="media_edukasi")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+# Semua layar statis dibangun sekali saat startup. InlineKeyboardMarkup di
+# PTB 20 immutable, jadi objek yang sama aman dipakai ulang di tiap balasan.
+BAHASA_DEFAULT = "id"
+
+KECAMATAN = [
+    "Paringin", "Paringin Selatan", "Awayan", "Batu Mandi",
+    "Lampihong", "Juai", "Halong", "Luar Wilayah",
+]
+
+TEKS_LAYAR = {
+    "id": {
+        "start": (
+            "👋 *Salamat Datang di TemanHIV*\n"
+            "_Layanan Konsultasi HIV oleh KPAD Kabupaten_\n\n"
+            "TemanHIV membantu pian memperoleh informasi HIV secara aman, rahasia, dan terpercaya.\n\n"
+            "Pian dapat menggunakan nama samaran.\n\n"
+            "Silakan tulis nama samaran pian untuk memulai:"
+        ),
+        "menu_utama": "🌟 *Menu Utama*\nSilakan pilih layanan:",
+        "pilih_kecamatan": "Halo *{alias}*, pilih kecamatan pian:",
+        "panduan": (
+            "ℹ️ *Panduan Layanan TemanHIV – KPAD Kabupaten*\n\n"
+            "TemanHIV adalah layanan konsultasi HIV yang dikelola oleh "
+            "KPAD Kabupaten untuk membantu masyarakat memperoleh informasi yang benar, aman, dan rahasia.\n\n"
+            "🔹 Pian dapat menggunakan nama samaran.\n"
+            "🔹 Data dan percakapan dijaga kerahasiaannya.\n"
+            "🔹 Sistem menggunakan tiket (1 tiket untuk 1 pertanyaan).\n"
+            "🔹 Balasan admin dikirim langsung ke akun Telegram pian.\n\n"
+            "⏳ Layanan dapat diakses 24 jam.\n"
+            "Balasan diprioritaskan pada jam kerja\n"
+            "Senin–Jumat, 08.00–16.00 WITA.\n\n"
+            "Jika dalam kondisi darurat medis, segera hubungi fasilitas kesehatan terdekat.\n\n"
+            "Terima kasih telah mempercayakan layanan ini."
+        ),
+        "kirim_tatakunan": (
+            "📨 *Kirim Tatakunan*\n\n"
+            "Sistem ini menggunakan sistem tiket konsultasi.\n\n"
+            "🔹 1 tiket hanya untuk 1 pertanyaan.\n"
+            "🔹 Jika memiliki pertanyaan lain, silakan membuat tiket baru setelah pertanyaan sebelumnya dibalas.\n"
+            "🔹 Mohon tidak mengirim pesan berulang untuk pertanyaan yang sama.\n\n"
+            "Balasan akan dikirim secara pribadi ke akun Telegram pian.\n\n"
+            "Silakan tuliskan pertanyaan pian dengan jelas dan lengkap."
+        ),
+        "chat_admin_info": (
+            "💬 *Chat Langsung dengan Admin*\n\n"
+            "Dengan memilih menu ini:\n\n"
+            "🔹 Pian akan terhubung langsung ke akun pribadi admin.\n"
+            "🔹 Identitas Telegram atau WhatsApp pian akan terlihat oleh admin.\n"
+            "🔹 Admin menjaga kerahasiaan sesuai etika layanan KPAD Kabupaten.\n\n"
+            "Jika ingin tetap menggunakan nama samaran, silakan gunakan menu *Kirim Tatakunan*.\n\n"
+            "Apakah pian ingin melanjutkan?"
+        ),
+        "tombol_menu": [
+            ("ℹ️ Panduan Layanan", "panduan"),
+            ("📋 Tatakunan Umum", "tatakunan_umum"),
+            ("📋 Cek Risiko HIV", "cek_risiko"),
+            ("📨 Kirim Tatakunan", "kirim_tatakunan"),
+            ("💬 Chat dengan Admin", "chat_admin_info"),
+            ("📚 Media Edukasi", "media_edukasi"),
+        ],
+        "kembali": "⬅️ Kembali",
+        "lanjutkan": "✅ Lanjutkan",
+        "ya": "Ya",
+        "tidak": "Tidak",
+        "halaman": "_Halaman {nomor}/{total}_",
+    },
+}
+
+def bangun_layar(teks):
+    kembali = [InlineKeyboardButton(teks["kembali"], callback_data="kembali_menu")]
+    kembali_keyboard = InlineKeyboardMarkup([kembali])
+
+    return {
+        "start": (teks["start"], None),
+        "menu_utama": (teks["menu_utama"], InlineKeyboardMarkup(
+            [[InlineKeyboardButton(label, callback_data=data)] for label, data in teks["tombol_menu"]]
+        )),
+        "pilih_kecamatan": (teks["pilih_kecamatan"], InlineKeyboardMarkup(
+            [[InlineKeyboardButton(k, callback_data=f"alamat_{k}")] for k in KECAMATAN]
+        )),
+        "panduan": (teks["panduan"], kembali_keyboard),
+        "kirim_tatakunan": (teks["kirim_tatakunan"], None),
+        "chat_admin_info": (teks["chat_admin_info"], InlineKeyboardMarkup([
+            [InlineKeyboardButton(teks["lanjutkan"], callback_data="chat_admin")],
+            kembali,
+        ])),
+        "kembali": (None, kembali_keyboard),
+        "risiko": (None, InlineKeyboardMarkup([[
+            InlineKeyboardButton(teks["ya"], callback_data="res_ya"),
+            InlineKeyboardButton(teks["tidak"], callback_data="res_no"),
+        ]])),
+        "halaman": (teks["halaman"], None),
+    }
+
+LAYAR = {bahasa: bangun_layar(teks) for bahasa, teks in TEKS_LAYAR.items()}
+
+def bahasa_user(update: Update):
+    user = update.effective_user
+    return user.language_code if user else None
+
+def layar(nama, bahasa=None):
+    """(teks, keyboard) dari registry; varian bahasa yang tidak ada jatuh ke BAHASA_DEFAULT."""
+    varian = LAYAR.get(bahasa) or LAYAR[BAHASA_DEFAULT]
+    return varian.get(nama) or LAYAR[BAHASA_DEFAULT][nama]
+
+def menu_utama_keyboard(bahasa=None):
+    return layar("menu_utama", bahasa)[1]
+
+def panjang_telegram(teks):
+    # Batas pesan Telegram dihitung dalam unit UTF-16 (emoji = 2)
+    return len(teks.encode("utf-16-le")) // 2
+
+BATAS_HALAMAN = MessageLimit.MAX_TEXT_LENGTH - 64  # sisa untuk footer halaman
+
+def bagi_baris(teks, batas):
+    """Pecah teks di batas baris (baris yang kepanjangan di batas kata) jadi potongan <= batas."""
+    potongan = []
+    sekarang = ""
+    for baris in teks.split("\n"):
+        while panjang_telegram(baris) > batas:
+            if sekarang:
+                potongan.append(sekarang)
+                sekarang = ""
+            # batas // 2 karakter pasti <= batas unit UTF-16
+            potong = baris.rfind(" ", 0, batas // 2)
+            if potong <= 0:
+                potong = batas // 2
+            potongan.append(baris[:potong])
+            baris = baris[potong:].lstrip()
+        calon = f"{sekarang}\n{baris}" if sekarang else baris
+        if panjang_telegram(calon) <= batas:
+            sekarang = calon
+        else:
+            potongan.append(sekarang)
+            sekarang = baris
+    if sekarang:
+        potongan.append(sekarang)
+    return potongan
+
+def bagi_halaman(blok, batas=BATAS_HALAMAN):
+    """Susun blok Markdown utuh (entitas sudah tertutup) jadi halaman <= batas.
+
+    Blok tidak pernah dipotong di sini; blok yang bisa kepanjangan harus
+    dipecah dulu oleh pembuatnya, mis. blok_faq().
+    """
+    halaman = []
+    sekarang = ""
+    for b in blok:
+        calon = f"{sekarang}\n\n{b}" if sekarang else b
+        if sekarang and panjang_telegram(calon) > batas:
+            halaman.append(sekarang)
+            sekarang = b
+        else:
+            sekarang = calon
+    if sekarang:
+        halaman.append(sekarang)
+    return halaman or [""]
+
+def layar_halaman(halaman, nomor, prefix, bahasa=None):
+    """Teks + keyboard navigasi untuk halaman ke-`nomor` (mulai 0)."""
+    total = len(halaman)
+    nomor = max(0, min(nomor, total - 1))
+    if total == 1:
+        return halaman[0], layar("kembali", bahasa)[1]
+
+    footer = layar("halaman", bahasa)[0].format(nomor=nomor + 1, total=total)
+    navigasi = []
+    if nomor > 0:
+        navigasi.append(InlineKeyboardButton("◀️", callback_data=f"{prefix}_{nomor - 1}"))
+    if nomor < total - 1:
+        navigasi.append(InlineKeyboardButton("▶️", callback_data=f"{prefix}_{nomor + 1}"))
+
+    keyboard = InlineKeyboardMarkup([navigasi] + list(layar("kembali", bahasa)[1].inline_keyboard))
+    return f"{halaman[nomor]}\n\n{footer}", keyboard
 
 # =========================
 # DATA DINAMIS
 # =========================
-async def get_faq_text():
+def blok_faq(pertanyaan, jawaban, batas=BATAS_HALAMAN):
+    """Satu record FAQ jadi satu atau beberapa blok Markdown.
+
+    Jawaban yang kepanjangan dipotong per baris; tiap potongan dibungkus
+    `_..._` sendiri supaya entitas tidak terbelah di antara dua halaman.
+    """
+    judul = f"❓ *{pertanyaan}*"
+    ruang = max(batas - panjang_telegram(judul) - 3, 200)  # "\n" + dua "_"
+    bagian = [p.strip() for p in bagi_baris(str(jawaban), ruang) if p.strip()]
+    if not bagian:
+        return [judul]
+    return [f"{judul}\n_{bagian[0]}_"] + [f"_{p}_" for p in bagian[1:]]
+
+async def get_faq_halaman():
     try:
-        ws = client.open_by_key(SPREADSHEET_ID).worksheet("FAQ")
+        ws = get_worksheet("FAQ")
         records = ws.get_all_records()
         if not records:
-            return "Data FAQ kosong."
-        teks = "📑 *Tatakunan Umum (FAQ)*\n\n"
+            return ["Data FAQ kosong."]
+        blok = ["📑 *Tatakunan Umum (FAQ)*"]
         for r in records:
-            teks += f"❓ *{r['Pertanyaan']}*\n_{r['Jawaban']}_\n\n"
-        return teks
+            blok += blok_faq(r["Pertanyaan"], r["Jawaban"])
+        return bagi_halaman(blok)
     except:
-        return "⚠️ Gagal mengambil FAQ."
+        return ["⚠️ Gagal mengambil FAQ."]
 
 async def get_admin_markup(alias, usia):
     try:
-        ws = client.open_by_key(SPREADSHEET_ID).worksheet("Admin")
+        ws = get_worksheet("Admin")
         records = ws.get_all_records()
         keyboard = []
         msg = f"Halo, saya {alias} ({usia} tahun) ingin konsultasi HIV."
@@ -117,64 +454,204 @@ async def get_admin_markup(alias, usia):
 
 async def get_risk_questions():
     try:
-        ws = client.open_by_key(SPREADSHEET_ID).worksheet("Pertanyaan_Risiko")
+        ws = get_worksheet("Pertanyaan_Risiko")
         return [r["Pertanyaan"] for r in ws.get_all_records() if r["Pertanyaan"]]
     except:
         return []
 
 async def get_media_edukasi():
     try:
-        ws = client.open_by_key(SPREADSHEET_ID).worksheet("Media_Edukasi")
+        ws = get_worksheet("Media_Edukasi")
         records = ws.get_all_records()
         if not records:
             return "Data Media Edukasi kosong.", None
 
         teks = "📚 *Media Edukasi HIV*\n\n"
         keyboard = []
+        muat_media_edukasi(records)
 
         for r in records:
             if r.get("Status", "").lower() == "aktif":
                 teks += f"📄 *{r['Judul']}*\n_{r['Deskripsi']}_\n\n"
-                keyboard.append([InlineKeyboardButton(f"🔗 {r['Judul']}", url=r["Link"])])
+                if r.get("Link"):
+                    keyboard.append([InlineKeyboardButton(f"🔗 {r['Judul']}", url=r["Link"])])
+                if r.get("File"):
+                    keyboard.append([InlineKeyboardButton(f"📥 {r['Judul']}", callback_data=f"edu_{kunci_media(r['File'])}")])
 
         keyboard.append([InlineKeyboardButton("⬅️ Kembali", callback_data="kembali_menu")])
         return teks, InlineKeyboardMarkup(keyboard)
     except:
         return "⚠️ Gagal mengambil media.", None
 
+# kunci tombol -> {"sumber", "judul", "file_id"}; diisi setiap menu Media
+# Edukasi dibangun, jadi tombol biasanya terkirim tanpa membaca sheet lagi.
+media_edukasi = {}
+
+def kunci_media(sumber):
+    # Kunci tombol dari isi kolom File, bukan posisi baris: tetap benar
+    # walaupun baris sheet ditambah/dihapus setelah menu ditampilkan.
+    return hashlib.sha1(str(sumber).strip().encode()).hexdigest()[:16]
+
+def muat_media_edukasi(records):
+    """Bangun ulang peta media aktif; file_id yang sudah terbukti jalan tetap dipakai."""
+    file_id_lama = {m["sumber"]: m["file_id"] for m in media_edukasi.values() if m["file_id"]}
+    media_edukasi.clear()
+    for r in records:
+        sumber = str(r.get("File", "")).strip()
+        if not sumber or str(r.get("Status", "")).lower() != "aktif":
+            continue
+        media_edukasi[kunci_media(sumber)] = {
+            "sumber": sumber,
+            "judul": r["Judul"],
+            # Kolom File_ID opsional hanya bibit awal; dibuang kalau gagal
+            "file_id": file_id_lama.get(sumber) or str(r.get("File_ID", "")).strip() or None,
+        }
+
+async def kirim_media_edukasi(query, context: ContextTypes.DEFAULT_TYPE, kunci):
+    if kunci not in media_edukasi:
+        try:
+            muat_media_edukasi(get_worksheet("Media_Edukasi").get_all_records())
+        except:
+            await query.message.reply_text("⚠️ Gagal mengambil media.")
+            return
+
+    media = media_edukasi.get(kunci)
+    if not media:
+        await query.message.reply_text("⚠️ Media sudah tidak tersedia.")
+        return
+
+    # Coba file_id dulu (instan dari sisi Telegram); kalau basi, misalnya
+    # setelah token bot diganti, ulangi sekali dengan isi kolom File.
+    kandidat = [media["file_id"]] if media["file_id"] and media["file_id"] != media["sumber"] else []
+    kandidat.append(media["sumber"])
+
+    pesan = None
+    for dokumen in kandidat:
+        try:
+            pesan = await context.bot.send_document(
+                chat_id=query.message.chat_id,
+                document=dokumen,
+                caption=f"📄 {media['judul']}"
+            )
+            break
+        except Exception as e:
+            media["file_id"] = None
+            logger.error("Gagal kirim media edukasi", extra={"error": str(e)})
+
+    if not pesan:
+        await query.message.reply_text("⚠️ Gagal mengirim media.")
+        return
+
+    if pesan.document:
+        media["file_id"] = pesan.document.file_id
+
+# =========================
+# LAMPIRAN
+# =========================
+MIME_DOKUMEN_DIIZINKAN = {"application/pdf", "image/jpeg", "image/png"}
+JENIS_LAMPIRAN = {"photo": "Foto", "document": "Dokumen", "voice": "Pesan suara"}
+FILTER_PESAN = filters.TEXT | filters.PHOTO | filters.Document.ALL | filters.VOICE
+
+def ambil_lampiran(message):
+    """(jenis, file_id, ukuran, mime_type) dari pesan, atau None kalau tanpa lampiran."""
+    if message.photo:
+        foto = message.photo[-1]  # resolusi terbesar
+        return "photo", foto.file_id, foto.file_size, "image/jpeg"
+    if message.document:
+        doc = message.document
+        return "document", doc.file_id, doc.file_size, doc.mime_type
+    if message.voice:
+        voice = message.voice
+        return "voice", voice.file_id, voice.file_size, voice.mime_type
+    return None
+
+def cek_lampiran(lampiran):
+    """Pesan kesalahan kalau lampiran melewati batas, None kalau aman."""
+    jenis, _, ukuran, mime = lampiran
+    if ukuran and ukuran > MAX_LAMPIRAN_MB * 1024 * 1024:
+        return f"⚠️ Ukuran file maksimal {MAX_LAMPIRAN_MB} MB."
+    if jenis == "document" and mime not in MIME_DOKUMEN_DIIZINKAN:
+        return "⚠️ Dokumen hanya boleh berformat PDF, JPG, atau PNG."
+    return None
+
+def gabung_lampiran(text, lampiran):
+    if not lampiran:
+        return text
+    return f"{text}\n📎 {JENIS_LAMPIRAN[lampiran[0]]}".strip()
+
+def format_lampiran(lampiran):
+    return f"{lampiran[0]}:{lampiran[1]}" if lampiran else ""
+
+def baca_lampiran(teks):
+    """Kebalikan format_lampiran untuk isi kolom L/M (satu lampiran per baris)."""
+    hasil = []
+    for baris in str(teks).splitlines():
+        jenis, _, file_id = baris.strip().partition(":")
+        if jenis in JENIS_LAMPIRAN and file_id:
+            hasil.append((jenis, file_id))
+    return hasil
+
+async def kirim_lampiran(bot, chat_id, lampiran, caption=None):
+    # Diteruskan lewat file_id, tanpa unduh/unggah ulang
+    jenis, file_id = lampiran[0], lampiran[1]
+    if jenis == "photo":
+        return await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
+    if jenis == "document":
+        return await bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
+    return await bot.send_voice(chat_id=chat_id, voice=file_id, caption=caption)
+
+async def teruskan_lampiran(bot, chat_id, lampiran, caption, kode):
+    """Seperti kirim_lampiran, tapi gagal kirim hanya dicatat (True kalau terkirim).
+
+    Dipakai setelah tiket/teks utama beres, supaya lampiran yang gagal tidak
+    membatalkan alur tiket di tengah jalan.
+    """
+    try:
+        await kirim_lampiran(bot, chat_id, lampiran, caption=caption)
+        return True
+    except Exception as e:
+        logger.error("Gagal kirim lampiran", extra={"kode": kode, "error": str(e)})
+        return False
+
+async def kirim_lampiran_tiket(bot, chat_id, row, kode):
+    """Kirim ulang lampiran klien (kolom L) saat tiket ditampilkan ke admin."""
+    for lampiran in baca_lampiran(row[11] if len(row) > 11 else ""):
+        await teruskan_lampiran(bot, chat_id, lampiran, f"📎 Lampiran tiket {kode}", kode)
+
 # =========================
 # START
 # =========================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     context.user_data["mode"] = "input_alias"
-    await update.message.reply_text(
-        "👋 *Salamat Datang di TemanHIV*\n"
-        "_Layanan Konsultasi HIV oleh KPAD Kabupaten_\n\n"
-        "TemanHIV membantu pian memperoleh informasi HIV secara aman, rahasia, dan terpercaya.\n\n"
-        "Pian dapat menggunakan nama samaran.\n\n"
-        "Silakan tulis nama samaran pian untuk memulai:",
-        parse_mode=ParseMode.MARKDOWN
-    )
+    teks, _ = layar("start", bahasa_user(update))
+    await update.message.reply_text(teks, parse_mode=ParseMode.MARKDOWN)
 
 # =========================
 # USER MESSAGE
 # =========================
 async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     mode = context.user_data.get("mode")
-    text = update.message.text.strip()
+    text = (update.message.text or update.message.caption or "").strip()
+    bahasa = bahasa_user(update)
+    lampiran = ambil_lampiran(update.message)
+
+    if lampiran and mode != "kirim_tatakunan":
+        await update.message.reply_text(
+            "📎 Lampiran hanya dapat dikirim melalui menu *Kirim Tatakunan*.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
 
     if mode == "input_alias":
         context.user_data["alias"] = text
         context.user_data["mode"] = "pilih_alamat"
 
-        keyboard = [[InlineKeyboardButton(k, callback_data=f"alamat_{k}")]
-                    for k in ["Paringin", "Paringin Selatan", "Awayan", "Batu Mandi",
-                              "Lampihong", "Juai", "Halong", "Luar Wilayah"]]
+        teks, keyboard = layar("pilih_kecamatan", bahasa)
 
         await update.message.reply_text(
-            f"Halo *{text}*, pilih kecamatan pian:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            teks.format(alias=text),
+            reply_markup=keyboard,
             parse_mode=ParseMode.MARKDOWN
         )
 
@@ -184,7 +661,7 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             context.user_data["mode"] = None
             await update.message.reply_text(
                 f"Data tersimpan!\n👤 {context.user_data['alias']}\n🎂 {text} tahun",
-                reply_markup=menu_utama_keyboard(),
+                reply_markup=menu_utama_keyboard(bahasa),
                 parse_mode=ParseMode.MARKDOWN
             )
         else:
@@ -207,6 +684,14 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 "Silakan isi kembali nama samaran pian:"
             )
             return
+
+        if lampiran:
+            error = cek_lampiran(lampiran)
+            if error:
+                await update.message.reply_text(error)
+                return
+
+        isi = gabung_lampiran(text, lampiran)
     
         wita = timezone(timedelta(hours=8))
         now_dt = datetime.now(wita)
@@ -233,9 +718,10 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         if existing_ticket:
     
             kode = existing_ticket[5]
+            log_kode.set(kode)
             isi_lama = existing_ticket[3]
     
-            tambahan = f"+ ({waktu}) {text}"
+            tambahan = f"+ ({waktu}) {isi}"
             isi_baru = f"{isi_lama}\n\n{tambahan}"
     
             # Update kolom D (Pertanyaan)
@@ -243,6 +729,14 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 range_name=f"D{existing_row_number}",
                 values=[[isi_baru]]
             )
+
+            # Update kolom L (Lampiran)
+            if lampiran:
+                lampiran_lama = existing_ticket[11] if len(existing_ticket) > 11 else ""
+                sheet_main.update(
+                    range_name=f"L{existing_row_number}",
+                    values=[["\n".join(filter(None, [lampiran_lama, format_lampiran(lampiran)]))]]
+                )
     
             # Notifikasi ke admin
             await context.bot.send_message(
@@ -255,12 +749,15 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 ),
                 parse_mode=ParseMode.MARKDOWN
             )
+
+            if lampiran:
+                await teruskan_lampiran(context.bot, ADMIN_GROUP_ID, lampiran, f"📎 Lampiran tiket {kode}", kode)
     
             await update.message.reply_text(
                 f"📝 Tambahan berhasil dikirim ke tiket 🆔 {kode}.\n"
                 "Admin akan membalas setelah tiket diproses.\n\n"
                 "Silakan pilih menu berikutnya:",
-                reply_markup=menu_utama_keyboard()
+                reply_markup=menu_utama_keyboard(bahasa)
             )
     
             context.user_data["mode"] = None
@@ -271,12 +768,13 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         # =========================================
     
         kode = f"K{int(datetime.now().timestamp())}"
+        log_kode.set(kode)
     
         text_admin = (
             f"📨 *Tatakunan Baru*\n"
             f"👤 {alias} ({usia} thn)\n"
             f"📍 {alamat}\n"
-            f"🆔 `{kode}`\n\n{text}"
+            f"🆔 `{kode}`\n\n{isi}"
         )
     
         btn = [[
@@ -292,21 +790,27 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=InlineKeyboardMarkup(btn)
         )
-    
+
         if sheet_main:
             sheet_main.append_row([
                 waktu,
                 alias,
                 usia,
-                text,
+                isi,
                 "",
                 kode,
                 "",
                 alamat,
                 "Pending",
                 "",
-                user_id
+                user_id,
+                format_lampiran(lampiran)
             ])
+
+        # Setelah baris tiket tersimpan: lampiran yang gagal tidak boleh
+        # meninggalkan tombol Balas tanpa tiket di sheet
+        if lampiran:
+            await teruskan_lampiran(context.bot, ADMIN_GROUP_ID, lampiran, f"📎 Lampiran tiket {kode}", kode)
     
         await update.message.reply_text(
             f"✅ Tatakunan terkirim.\n🆔 Kode tiket pian: {kode}"
@@ -316,7 +820,7 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     
         await update.message.reply_text(
             "Pilih menu lainnya:",
-            reply_markup=menu_utama_keyboard()
+            reply_markup=menu_utama_keyboard(bahasa)
         )
 
 # =========================
@@ -326,48 +830,40 @@ async def tombol_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     data = query.data
+    bahasa = bahasa_user(update)
     
     if data == "panduan":
-        teks = (
-            "ℹ️ *Panduan Layanan TemanHIV – KPAD Kabupaten*\n\n"
-            "TemanHIV adalah layanan konsultasi HIV yang dikelola oleh "
-            "KPAD Kabupaten untuk membantu masyarakat memperoleh informasi yang benar, aman, dan rahasia.\n\n"
-            "🔹 Pian dapat menggunakan nama samaran.\n"
-            "🔹 Data dan percakapan dijaga kerahasiaannya.\n"
-            "🔹 Sistem menggunakan tiket (1 tiket untuk 1 pertanyaan).\n"
-            "🔹 Balasan admin dikirim langsung ke akun Telegram pian.\n\n"
-            "⏳ Layanan dapat diakses 24 jam.\n"
-            "Balasan diprioritaskan pada jam kerja\n"
-            "Senin–Jumat, 08.00–16.00 WITA.\n\n"
-            "Jika dalam kondisi darurat medis, segera hubungi fasilitas kesehatan terdekat.\n\n"
-            "Terima kasih telah mempercayakan layanan ini."
-        )
+        teks, keyboard = layar("panduan", bahasa)
 
         await query.edit_message_text(
             teks,
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("⬅️ Kembali", callback_data="kembali_menu")]]
-            )
+            reply_markup=keyboard
         )
         return
-    elif data == "tatakunan_umum":
-        teks = await get_faq_text()
+    elif data == "tatakunan_umum" or data.startswith("faq_"):
+        nomor = int(data.split("_")[1]) if data.startswith("faq_") else 0
+        halaman = await get_faq_halaman()
+        teks, keyboard = layar_halaman(halaman, nomor, "faq", bahasa)
         await query.edit_message_text(
             teks,
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Kembali", callback_data="kembali_menu")]])
+            reply_markup=keyboard
         )
         
+    elif data.startswith("edu_"):
+        await kirim_media_edukasi(query, context, data.split("_", 1)[1])
+
     elif data.startswith("plist_"):
         page = int(data.split("_")[1])
         context.args = [str(page)]
         await list_pending(update, context)
         
     elif data == "kembali_menu":
+        teks, keyboard = layar("menu_utama", bahasa)
         await query.edit_message_text(
-            "🌟 *Menu Utama*\nSilakan pilih layanan:",
-            reply_markup=menu_utama_keyboard(),
+            teks,
+            reply_markup=keyboard,
             parse_mode=ParseMode.MARKDOWN
         )
 
@@ -395,37 +891,16 @@ async def tombol_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
         context.user_data["mode"] = "kirim_tatakunan"
     
-        await query.edit_message_text(
-            "📨 *Kirim Tatakunan*\n\n"
-            "Sistem ini menggunakan sistem tiket konsultasi.\n\n"
-            "🔹 1 tiket hanya untuk 1 pertanyaan.\n"
-            "🔹 Jika memiliki pertanyaan lain, silakan membuat tiket baru setelah pertanyaan sebelumnya dibalas.\n"
-            "🔹 Mohon tidak mengirim pesan berulang untuk pertanyaan yang sama.\n\n"
-            "Balasan akan dikirim secara pribadi ke akun Telegram pian.\n\n"
-            "Silakan tuliskan pertanyaan pian dengan jelas dan lengkap.",
-            parse_mode=ParseMode.MARKDOWN
-        )
+        teks, _ = layar("kirim_tatakunan", bahasa)
+        await query.edit_message_text(teks, parse_mode=ParseMode.MARKDOWN)
     elif data == "chat_admin_info":
 
-        teks = (
-            "💬 *Chat Langsung dengan Admin*\n\n"
-            "Dengan memilih menu ini:\n\n"
-            "🔹 Pian akan terhubung langsung ke akun pribadi admin.\n"
-            "🔹 Identitas Telegram atau WhatsApp pian akan terlihat oleh admin.\n"
-            "🔹 Admin menjaga kerahasiaan sesuai etika layanan KPAD Kabupaten.\n\n"
-            "Jika ingin tetap menggunakan nama samaran, silakan gunakan menu *Kirim Tatakunan*.\n\n"
-            "Apakah pian ingin melanjutkan?"
-        )
-
-        keyboard = [
-            [InlineKeyboardButton("✅ Lanjutkan", callback_data="chat_admin")],
-            [InlineKeyboardButton("⬅️ Kembali", callback_data="kembali_menu")]
-        ]
+        teks, keyboard = layar("chat_admin_info", bahasa)
 
         await query.edit_message_text(
             teks,
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=keyboard
         )
         return
         
@@ -452,10 +927,7 @@ async def tombol_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data["idx"] = 0
         await query.edit_message_text(
             f"❓ {questions[0]}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Ya", callback_data="res_ya"),
-                 InlineKeyboardButton("Tidak", callback_data="res_no")]
-            ])
+            reply_markup=layar("risiko", bahasa)[1]
         )
 
     elif data.startswith("res_"):
@@ -468,21 +940,18 @@ async def tombol_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if idx < len(questions):
             await query.edit_message_text(
                 f"❓ {questions[idx]}",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Ya", callback_data="res_ya"),
-                     InlineKeyboardButton("Tidak", callback_data="res_no")]
-                ])
+                reply_markup=layar("risiko", bahasa)[1]
             )
         else:
             skor = context.user_data["skor"]
-            hasil = "❗Pian Risiko Tinggi (Segera Tes & Konsultasi Admin)" if skor >= 3 else "✅ Resiko Pian Rendah, Tetap Pertahankan"
+            hasil = "❗Pian Risiko Tinggi (Segera Tes & Konsultasi Admin)" if skor >= AMBANG_RISIKO_TINGGI else "✅ Resiko Pian Rendah, Tetap Pertahankan"
         
             # ✅ SIMPAN KE SHEET RISIKO
             try:
                 wita = timezone(timedelta(hours=8))
                 now = datetime.now(wita).strftime("%Y-%m-%d %H:%M:%S")
         
-                rs_sheet = client.open_by_key(SPREADSHEET_ID).worksheet("Risiko")
+                rs_sheet = get_worksheet("Risiko")
         
                 rs_sheet.append_row([
                     now,
@@ -490,22 +959,40 @@ async def tombol_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     context.user_data.get("usia"),
                     skor,
                     hasil,
-                    context.user_data.get("alamat")
+                    context.user_data.get("alamat"),
+                    str(update.effective_user.id)
                 ])
             except Exception as e:
-                logger.error(f"Gagal simpan risiko: {e}")
+                logger.error("Gagal simpan risiko", extra={"error": str(e)})
         
             await query.edit_message_text(
                 f"Hasil Cek Risiko: *{hasil}* (Skor: {skor})",
                 parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton("⬅️ Kembali", callback_data="kembali_menu")]]
-                )
+                reply_markup=layar("kembali", bahasa)[1]
             )
 
 # =========================
 # LOCK TIKET (FINAL FIX)
 # =========================
+antrian_lock = asyncio.Lock()
+
+async def notifikasi_lock_klien(context: ContextTypes.DEFAULT_TYPE, row, kode):
+    # 🔔 NOTIFIKASI KE KLIEN BAHWA TIKET DI-LOCK
+    try:
+        user_id_sheet = str(row[10]).strip() if len(row) > 10 else ""
+        if user_id_sheet:
+            await context.bot.send_message(
+                chat_id=int(user_id_sheet),
+                text=(
+                    f"🔒 Tatakunan pian dengan kode 🆔 {kode} "
+                    "sedang diproses oleh admin.\n\n"
+                    "Pian tidak dapat menambahkan pesan lagi ke tiket ini.\n"
+                    "Mohon menunggu balasan."
+                )
+            )
+    except Exception as e:
+        logger.error("Gagal kirim notifikasi lock ke klien", extra={"kode": kode, "error": str(e)})
+
 async def handle_balas_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     query = update.callback_query
@@ -516,6 +1003,7 @@ async def handle_balas_admin(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     try:
         _, user_id, kode = query.data.split("_")
+        log_kode.set(kode)
     except:
         await query.message.reply_text("❌ Format tiket salah.")
         return
@@ -524,46 +1012,45 @@ async def handle_balas_admin(update: Update, context: ContextTypes.DEFAULT_TYPE)
     admin_id = str(admin_user.id).strip()
     admin_display = f"@{admin_user.username}" if admin_user.username else admin_user.first_name
 
-    try:
-        cell = sheet_main.find(kode, in_column=6)  # kolom F = Kode
-        row_number = cell.row
-        row = sheet_main.row_values(row_number)
-    except:
-        await query.message.reply_text("❌ Tiket tidak ditemukan.")
-        return
+    batas = get_batas_admin(admin_user)
 
-    status = str(row[8]).strip() if len(row) > 8 else ""
-    locked_by = str(row[9]).strip() if len(row) > 9 else ""
+    # Dikunci bersama /next supaya dua admin tidak mengambil tiket yang sama
+    async with antrian_lock:
+        try:
+            rows = sheet_main.get_all_values()
+            row_number, row = next(
+                (idx, row) for idx, row in enumerate(rows[1:], start=2)  # skip header
+                if len(row) > 5 and row[5] == kode  # kolom F = Kode
+            )
+        except:
+            await query.message.reply_text("❌ Tiket tidak ditemukan.")
+            return
 
-    if status == "Replied":
-        await query.message.reply_text("❌ Tiket sudah dibalas.")
-        return
+        status = str(row[8]).strip() if len(row) > 8 else ""
+        locked_by = str(row[9]).strip() if len(row) > 9 else ""
 
-    if status == "Locked" and locked_by and locked_by != admin_id:
-        await query.message.reply_text("🔒 Tiket sedang ditangani admin lain.")
-        return
+        if status == "Replied":
+            await query.message.reply_text("❌ Tiket sudah dibalas.")
+            return
 
-    # LOCK
-    sheet_main.update(
-        range_name=f"I{row_number}:J{row_number}",
-        values=[["Locked", admin_id]]
-    )
+        if status == "Locked" and locked_by and locked_by != admin_id:
+            await query.message.reply_text("🔒 Tiket sedang ditangani admin lain.")
+            return
 
-    # 🔔 NOTIFIKASI KE KLIEN BAHWA TIKET DI-LOCK
-    try:
-        user_id_sheet = str(row[10]).strip() if len(row) > 10 else ""
-        if user_id_sheet:
-            await context.bot.send_message(
-                chat_id=int(user_id_sheet),
-                text=(
-                    f"🔒 Tatakunan pian dengan kode 🆔 {kode} "
-                    "sedang diproses oleh admin.\n\n"
-                    "Pian tidak dapat menambahkan pesan lagi ke tiket ini.\n"
-                    "Mohon menunggu balasan."
-                )
-            )
-    except Exception as e:
-        logger.error(f"Gagal kirim notifikasi lock ke klien: {e}")
+        # Tiket yang sudah dipegang admin ini tidak menambah beban
+        if not (status == "Locked" and locked_by == admin_id):
+            error = cek_batas_admin(rows, admin_id, admin_display, batas)
+            if error:
+                await query.message.reply_text(error)
+                return
+
+        # LOCK
+        sheet_main.update(
+            range_name=f"I{row_number}:J{row_number}",
+            values=[["Locked", admin_id]]
+        )
+
+    await notifikasi_lock_klien(context, row, kode)
 
     await query.message.reply_text(
         f"🔒 Tiket dikunci oleh {admin_display}\n"
@@ -586,17 +1073,28 @@ async def admin_reply_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     import re
-    match = re.search(r'kode\s+([A-Za-z0-9]+)', reply_text)
-    if not match:
+    # Ambil yang terakhir: isi pertanyaan klien bisa saja memuat kata "kode"
+    matches = re.findall(r'membalas kode\s+([A-Za-z0-9]+)', reply_text)
+    if not matches:
         await update.message.reply_text("❌ Kode tidak ditemukan.")
         return
 
-    kode = match.group(1)
+    kode = matches[-1]
+    log_kode.set(kode)
 
     admin_user = update.effective_user
     admin_id = str(admin_user.id).strip()
     admin_display = f"@{admin_user.username}" if admin_user.username else admin_user.first_name
-    balasan = update.message.text
+    balasan = (update.message.text or update.message.caption or "").strip()
+    lampiran = ambil_lampiran(update.message)
+
+    if lampiran:
+        error = cek_lampiran(lampiran)
+        if error:
+            await update.message.reply_text(error)
+            return
+
+    balasan = gabung_lampiran(balasan, lampiran)
 
     try:
         cell = sheet_main.find(kode, in_column=6)
@@ -620,7 +1118,8 @@ async def admin_reply_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # Kirim ke client
+    # Kirim ke client: teks dulu, supaya status tiket mengikuti teks balasan;
+    # lampiran menyusul dan kegagalannya hanya dilaporkan ke admin
     try:
         await context.bot.send_message(
             chat_id=int(user_id),
@@ -638,9 +1137,13 @@ async def admin_reply_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Gagal kirim: {e}")
         return
 
+    lampiran_terkirim = bool(lampiran) and await teruskan_lampiran(
+        context.bot, int(user_id), lampiran, f"📎 Lampiran balasan admin 🆔 {kode}", kode
+    )
+
     # Update sheet → Replied
     sheet_main.update(
-        range_name=f"E{row_number}:K{row_number}",
+        range_name=f"E{row_number}:M{row_number}",
         values=[[
             balasan,
             kode,
@@ -648,9 +1151,18 @@ async def admin_reply_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             row[7] if len(row) > 7 else "",
             "Replied",
             "",
-            user_id
+            user_id,
+            row[11] if len(row) > 11 else "",
+            format_lampiran(lampiran) if lampiran_terkirim else ""
         ]]
     )
+
+    if lampiran and not lampiran_terkirim:
+        await update.message.reply_text(
+            "⚠️ Balasan teks terkirim & status diperbarui, tetapi lampiran gagal dikirim ke klien."
+        )
+        return
+
     await update.message.reply_text("✅ Balasan terkirim & status diperbarui.")
 # =========================
 # LIST PENDING (FIX FINAL)
@@ -697,7 +1209,7 @@ async def list_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"🆔 *{kode}*\n"
             f"👤 {nama} ({usia} thn)\n"
             f"📍 {alamat}\n"
-            f"❓ {pertanyaan}"
+            f"❓ {ringkas(pertanyaan)}"
         )
 
         if user_id:
@@ -716,20 +1228,213 @@ async def list_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await target.reply_text(teks, parse_mode=ParseMode.MARKDOWN)
 
+        await kirim_lampiran_tiket(context.bot, target.chat_id, row, kode)
+
+# =========================
+# CLAIM NEXT (ANTRIAN TIKET)
+# =========================
+BOBOT_RISIKO_TINGGI = 24  # setara menunggu 24 jam
+BOBOT_TAMBAHAN = 2        # per pesan tambahan dari klien
+BATAS_RINGKAS = 3000      # sisa ruang untuk identitas tiket & instruksi reply
+
+def get_user_risiko_tinggi():
+    """User ID (atau alias, usia, alamat untuk data lama) dengan skor risiko tinggi."""
+    try:
+        ws = get_worksheet("Risiko")
+        rows = ws.get_all_values()
+    except:
+        return set()
+
+    hasil = set()
+    for row in rows[1:]:  # skip header
+        if len(row) < 6 or not str(row[3]).strip().isdigit():
+            continue
+        if int(row[3]) < AMBANG_RISIKO_TINGGI:
+            continue
+        if len(row) > 6 and row[6]:
+            hasil.add(str(row[6]).strip())
+        else:
+            hasil.add((row[1], str(row[2]), row[5]))
+    return hasil
+
+def get_batas_admin(admin_user):
+    """Batas tiket Locked per admin, dari entri Telegram aktif di worksheet Admin.
+
+    Kapasitas diambil dari kolom opsional 'Kapasitas' (MAX_TIKET_ADMIN kalau
+    kosong). Anggota grup yang tidak terdaftar, tidak punya username, atau
+    tidak aktif mendapat 0. Hanya kalau sheet Admin gagal dibaca semua admin
+    memakai MAX_TIKET_ADMIN, supaya layanan tidak berhenti total.
+    """
+    username = (admin_user.username or "").lower()
+    if not username:
+        return 0
+
+    try:
+        records = get_worksheet("Admin").get_all_records()
+    except:
+        return MAX_TIKET_ADMIN
+
+    for r in records:
+        if r.get("Tipe") != "Telegram":
+            continue
+        if str(r.get("Kontak", "")).lstrip("@").lower() != username:
+            continue
+        if str(r.get("Status", "")).lower() != "aktif":
+            return 0
+        kapasitas = str(r.get("Kapasitas", "")).strip()
+        return int(kapasitas) if kapasitas.isdigit() else MAX_TIKET_ADMIN
+
+    return 0
+
+def hitung_beban(rows, admin_id):
+    return sum(
+        1 for row in rows[1:]  # skip header
+        if len(row) > 9 and row[8].strip() == "Locked" and row[9].strip() == admin_id
+    )
+
+def cek_batas_admin(rows, admin_id, admin_display, batas):
+    """Pesan penolakan kalau admin tidak aktif atau beban tiket Locked-nya penuh."""
+    if batas <= 0:
+        return f"⛔ {admin_display} tidak terdaftar atau tidak aktif di daftar Admin (Telegram)."
+
+    beban = hitung_beban(rows, admin_id)
+    if beban >= batas:
+        return (
+            f"⚠️ {admin_display} masih memegang {beban}/{batas} tiket.\n"
+            "Selesaikan balasan terlebih dahulu."
+        )
+    return None
+
+def ringkas(teks, batas=BATAS_RINGKAS):
+    """Potong teks panjang di batas baris supaya pesan ke admin tetap di bawah limit Telegram."""
+    potongan = bagi_baris(teks, batas)
+    if len(potongan) <= 1:
+        return teks
+    return f"{potongan[0]}\n… (terpotong, lihat sheet Konsultasi)"
+
+def is_risiko_tinggi(row, risiko_tinggi):
+    return (
+        str(row[10]).strip() in risiko_tinggi
+        or (row[1], str(row[2]), row[7]) in risiko_tinggi
+    )
+
+def skor_prioritas(row, now_dt, risiko_tinggi):
+    wita = timezone(timedelta(hours=8))
+    try:
+        dibuat = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S").replace(tzinfo=wita)
+    except:
+        try:
+            dibuat = datetime.fromtimestamp(int(row[5][1:]), wita)  # K<timestamp>
+        except:
+            dibuat = now_dt
+
+    skor = max((now_dt - dibuat).total_seconds() / 3600, 0)
+    skor += BOBOT_TAMBAHAN * row[3].count("\n\n+ (")
+    if is_risiko_tinggi(row, risiko_tinggi):
+        skor += BOBOT_RISIKO_TINGGI
+    return skor
+
+async def claim_next(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    if not is_admin_group(update):
+        return
+
+    if not sheet_main:
+        await update.message.reply_text("⚠️ Database belum tersedia.")
+        return
+
+    admin_user = update.effective_user
+    admin_id = str(admin_user.id).strip()
+    admin_display = f"@{admin_user.username}" if admin_user.username else admin_user.first_name
+
+    batas = get_batas_admin(admin_user)
+    risiko_tinggi = get_user_risiko_tinggi()
+
+    async with antrian_lock:
+        rows = sheet_main.get_all_values()
+
+        error = cek_batas_admin(rows, admin_id, admin_display, batas)
+        if error:
+            await update.message.reply_text(error)
+            return
+
+        beban = hitung_beban(rows, admin_id)
+
+        wita = timezone(timedelta(hours=8))
+        now_dt = datetime.now(wita)
+        antrian = []
+
+        for idx, row in enumerate(rows[1:], start=2):  # skip header
+            if len(row) > 10 and row[8].strip() == "Pending" and row[10].strip():
+                heapq.heappush(antrian, (-skor_prioritas(row, now_dt, risiko_tinggi), idx, row))
+
+        if not antrian:
+            await update.message.reply_text("✅ Tidak ada tiket Pending.")
+            return
+
+        _, row_number, row = heapq.heappop(antrian)
+
+        # LOCK
+        sheet_main.update(
+            range_name=f"I{row_number}:J{row_number}",
+            values=[["Locked", admin_id]]
+        )
+
+    kode = row[5]
+    log_kode.set(kode)
+    await notifikasi_lock_klien(context, row, kode)
+
+    label_risiko = "❗ Risiko tinggi\n" if is_risiko_tinggi(row, risiko_tinggi) else ""
+
+    await update.message.reply_text(
+        f"🎯 Tiket berikutnya untuk {admin_display} ({beban + 1}/{batas})\n"
+        f"🆔 {kode}\n"
+        f"👤 {row[1]} ({row[2]} thn)\n"
+        f"📍 {row[7]}\n"
+        f"{label_risiko}"
+        f"❓ {ringkas(row[3])}\n\n"
+        f"🔒 Tiket dikunci oleh {admin_display}\n"
+        f"Reply pesan ini untuk membalas kode {kode}."
+    )
+
+    await kirim_lampiran_tiket(context.bot, update.effective_chat.id, row, kode)
+
 # =========================
 # RUN (AUTO WEBHOOK / POLLING)
 # =========================
 if __name__ == "__main__":
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    async def post_init(application):
+        global tugas_token_google
+        if creds:
+            tugas_token_google = asyncio.create_task(jaga_token_google())
+
+    async def post_shutdown(application):
+        if tugas_token_google:
+            tugas_token_google.cancel()
+            try:
+                await tugas_token_google
+            except asyncio.CancelledError:
+                pass
+
+    tugas_token_google = None
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # ===== Handlers =====
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("list", list_pending))
-    app.add_handler(CallbackQueryHandler(handle_balas_admin, pattern="^balas_"))
-    app.add_handler(CallbackQueryHandler(tombol_handler))
-    app.add_handler(MessageHandler(filters.TEXT & filters.ChatType.PRIVATE, handle_user_message))
-    app.add_handler(MessageHandler(filters.TEXT & filters.ChatType.GROUPS, admin_reply_text))
+    app.add_error_handler(catat_error)
+    app.add_handler(CommandHandler("start", dicatat(start)))
+    app.add_handler(CommandHandler("list", dicatat(list_pending)))
+    app.add_handler(CommandHandler("next", dicatat(claim_next)))
+    app.add_handler(CallbackQueryHandler(dicatat(handle_balas_admin), pattern="^balas_"))
+    app.add_handler(CallbackQueryHandler(dicatat(tombol_handler)))
+    app.add_handler(MessageHandler(FILTER_PESAN & filters.ChatType.PRIVATE, dicatat(handle_user_message)))
+    app.add_handler(MessageHandler(FILTER_PESAN & filters.ChatType.GROUPS, dicatat(admin_reply_text)))
 
     # =========================
     # MODE DETECTION
@@ -739,7 +1444,7 @@ if __name__ == "__main__":
 
     if PUBLIC_DOMAIN:
         WEBHOOK_URL = f"https://{PUBLIC_DOMAIN}"
-        logger.info(f"🚀 Running in WEBHOOK mode: {WEBHOOK_URL}")
+        logger.info("🚀 Running in WEBHOOK mode", extra={"webhook_url": WEBHOOK_URL})
 
         app.run_webhook(
             listen="0.0.0.0",
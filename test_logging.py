@@ -0,0 +1,58 @@
+import asyncio
+import json
+import logging
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("gspread")
+pytest.importorskip("google.auth")
+
+os.environ.setdefault("ADMIN_GROUP_ID", "0")
+
+import main
+
+
+def format_json(record):
+    assert main.KonteksLogFilter().filter(record)
+    return json.loads(main.JsonFormatter().format(record))
+
+
+def test_argumen_log_library_disensor():
+    record = logging.getLogger("telegram.ext.ExtBot").makeRecord(
+        "telegram.ext.ExtBot", logging.INFO, __file__, 1,
+        "Calling Bot API endpoint `%s` with parameters `%s`",
+        ("sendMessage", {"text": "Budi positif, minta hasil lab"}),
+        None,
+    )
+    data = format_json(record)
+
+    assert "Budi" not in json.dumps(data, ensure_ascii=False)
+    assert data["args_redacted"] is True
+
+
+def test_field_rahasia_disensor():
+    record = main.logger.makeRecord(
+        main.logger.name, logging.ERROR, __file__, 1, "Gagal simpan risiko", (), None,
+        extra={"alias": "Budi", "kode": "K1"},
+    )
+    data = format_json(record)
+
+    assert data["alias"] == "[redacted]"
+    assert data["kode"] == "K1"
+
+
+def test_debug_telegram_tidak_dicatat():
+    assert not logging.getLogger("telegram.ext.ExtBot").isEnabledFor(logging.DEBUG)
+
+
+def test_dicatat_meneruskan_error():
+    async def gagal(update, context):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError) as info:
+        asyncio.run(main.dicatat(gagal)(SimpleNamespace(update_id=1), None))
+
+    assert info.value.sudah_dicatat